@@ -1,13 +1,14 @@
 # app.py
 from __future__ import annotations
 import io, os, re, json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
 import streamlit as st
 import zipfile
 
@@ -82,22 +83,42 @@ PROGRAM_NAMES = CFG["program_names"]
 REGION_MAP = CFG["region_map"]
 XBM_MAP = CFG["xbm_map"]
 
+# Engine đọc Excel: ưu tiên calamine (Rust, nhanh hơn openpyxl nhiều lần)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 # =============== Common utils ===============
+# Regex compile sẵn ở mức module (khỏi phụ thuộc cache của re)
+_RE_MMYY = re.compile(r'(\d{1,2})\D+([12]\d{3})')
+_RE_YYMM = re.compile(r'([12]\d{3})\D+(\d{1,2})')
+_RE_THANG = re.compile(r'[Tt]?(\d{1,2})')
+_CT_KEY_RE = re.compile("|".join(re.escape(k) for k in MUC_TOI_THIEU.keys()), re.I)
+
+def _compile_route_pat(tokens: Optional[List[str]]) -> Optional[re.Pattern]:
+    """Gộp các token 'Thứ bán hàng' thành 1 regex alternation, compile đúng 1 lần."""
+    if not tokens:
+        return None
+    pat = "|".join(re.escape(t.strip()) for t in tokens if t.strip())
+    return re.compile(pat, re.IGNORECASE) if pat else None
+
 def parse_giai_to_dt(giai: str) -> datetime:
     """Dò định dạng 'Giai đoạn' và trả về datetime(YYYY, MM, 1)."""
     s = str(giai).strip()
     # Tháng 11/2025, T11/2025, 11/2025
-    m = re.search(r'(\d{1,2})\D+([12]\d{3})', s)
+    m = _RE_MMYY.search(s)
     if m:
         mm, yy = int(m.group(1)), int(m.group(2))
         return datetime(yy, mm, 1)
     # 2025-11, 2025/11
-    m = re.search(r'([12]\d{3})\D+(\d{1,2})', s)
+    m = _RE_YYMM.search(s)
     if m:
         yy, mm = int(m.group(1)), int(m.group(2))
         return datetime(yy, mm, 1)
     # T11 (mặc định năm hiện tại)
-    m = re.fullmatch(r'[Tt]?(\d{1,2})', s)
+    m = _RE_THANG.fullmatch(s)
     if m:
         mm = int(m.group(1))
         yy = datetime.now().year
@@ -109,9 +130,7 @@ def parse_giai_to_dt(giai: str) -> datetime:
         raise ValueError(f"Không nhận diện được Giai đoạn: {s}")
 
 def detect_ct_from_filename(fname: str) -> Optional[str]:
-    keys = list(MUC_TOI_THIEU.keys())
-    key_pat = "|".join(re.escape(k) for k in keys)
-    m = re.search(key_pat, fname, flags=re.I)
+    m = _CT_KEY_RE.search(fname)
     if m:
         return m.group(0).upper()
     return None
@@ -136,122 +155,135 @@ def detect_ct_from_content(df: pd.DataFrame) -> Optional[str]:
     return None
 
 # =============== Excel styling ===============
-from openpyxl import Workbook
-
-def style_excel(writer: pd.ExcelWriter, sheet_name: str) -> None:
-    ws = writer.sheets[sheet_name]
-    thin_border = Border(left=Side("thin"), right=Side("thin"), top=Side("thin"), bottom=Side("thin"))
-    header_fill = PatternFill(start_color="BFBFBF", end_color="BFBFBF", fill_type="solid")
-
-    # Header
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        cell.border = thin_border
-    ws.row_dimensions[1].height = 30
-
-    # Định dạng tiền cho các cột "Doanh số tích lũy *" & "Ngưỡng tối thiểu"
-    money_cols = set()
-    for idx, cell in enumerate(ws[1], start=1):
-        v = str(cell.value) if cell.value is not None else ""
+def ghi_sheet_ketqua(writer: pd.ExcelWriter, df: pd.DataFrame, sheet_name: str) -> None:
+    """Ghi 1 sheet kết quả bằng xlsxwriter (constant_memory: header trước, data sau)."""
+    book = writer.book
+    ws = book.add_worksheet(sheet_name)
+    writer.sheets[sheet_name] = ws
+
+    header_fmt = book.add_format({
+        "bold": True, "bg_color": "#BFBFBF", "border": 1,
+        "align": "center", "valign": "vcenter", "text_wrap": True,
+    })
+    cell_fmt = book.add_format({"border": 1, "valign": "vcenter"})
+    money_fmt = book.add_format({"border": 1, "valign": "vcenter", "num_format": "#,##0"})
+
+    # Border/căn dòng + định dạng tiền đặt ở mức cột (O(cols) thay vì O(rows×cols))
+    for i, col in enumerate(df.columns):
+        ws.write(0, i, str(col), header_fmt)
+        v = str(col)
         if v.startswith("Doanh số tích lũy") or v == "Ngưỡng tối thiểu":
-            money_cols.add(idx)
-
-    for r in ws.iter_rows(min_row=2, max_row=ws.max_row, max_col=ws.max_column):
-        for c in r:
-            c.border = thin_border
-            c.alignment = Alignment(vertical="center")
-            if c.col_idx in money_cols:
-                c.number_format = "#,##0"
-
-    # Tô màu theo 'Kết quả'
-    col_kq = None
-    for i, c in enumerate(ws[1], start=1):
-        if c.value == "Kết quả":
-            col_kq = i
-            break
-    if col_kq:
-        for r in range(2, ws.max_row + 1):
-            cell = ws.cell(row=r, column=col_kq)
-            if cell.value == "Không đạt":
-                cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-            elif cell.value == "Không xét":
-                cell.fill = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid")
-
-    # Auto width
-    for col in range(1, ws.max_column + 1):
-        ws.column_dimensions[get_column_letter(col)].width = 18
+            ws.set_column(i, i, 18, money_fmt)
+        else:
+            ws.set_column(i, i, 18, cell_fmt)
+    ws.set_row(0, 30)
+
+    # constant_memory stream theo dòng: NaN -> ô trống
+    vals = df.astype(object).where(pd.notna(df), None).to_numpy()
+    for r, row in enumerate(vals, start=1):
+        ws.write_row(r, 0, row)
+
+    # Tô màu theo 'Kết quả': 1 rule conditional format thay cho vòng lặp từng ô
+    if "Kết quả" in df.columns and len(df):
+        kq = df.columns.get_loc("Kết quả")
+        ws.conditional_format(1, kq, len(df), kq, {
+            "type": "cell", "criteria": "==", "value": '"Không đạt"',
+            "format": book.add_format({"bg_color": "#FFC7CE"})})
+        ws.conditional_format(1, kq, len(df), kq, {
+            "type": "cell", "criteria": "==", "value": '"Không xét"',
+            "format": book.add_format({"bg_color": "#FFEB9C"})})
 
 def tao_bao_cao_tonghop(writer: pd.ExcelWriter, bao_cao_data: List[List]) -> None:
-    ws = writer.book.create_sheet("BaoCao_TongHop")
-    ws.merge_cells("A1:F1")
-    ws["A1"] = "BÁO CÁO QUẦY TRƯNG BÀY KHÔNG ĐẠT DOANH SỐ TỐI THIỂU"
-    ws["A1"].alignment = Alignment(horizontal="center", vertical="center")
-    ws["A1"].font = Font(bold=True, size=14)
+    book = writer.book
+    ws = book.add_worksheet("BaoCao_TongHop")
+    ws.set_column(0, 0, 8)
+    ws.set_column(1, 1, 45)
+    ws.set_column(2, 5, 22)
+
+    title_fmt = book.add_format({"bold": True, "font_size": 14, "align": "center", "valign": "vcenter"})
+    ws.merge_range(0, 0, 0, 5, "BÁO CÁO QUẦY TRƯNG BÀY KHÔNG ĐẠT DOANH SỐ TỐI THIỂU", title_fmt)
 
     headers = ["STT", "Tên chương trình",
                "DOANH SỐ TỐI THIỂU PHÁT SINH/ SUẤT/ THÁNG (VND)",
                "TỔNG SỐ SUẤT TRƯNG BÀY", "SỐ SUẤT KHÔNG ĐẠT", "TỈ LỆ"]
-    ws.append(headers)
-
-    fill_yellow = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-    fill_red = PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")
-    thin = Border(left=Side("thin"), right=Side("thin"), top=Side("thin"), bottom=Side("thin"))
-
-    for i in range(1, len(headers) + 1):
-        c = ws.cell(row=2, column=i)
-        c.font = Font(bold=True)
-        c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        if i in (3, 4): c.fill = fill_yellow
-        if i in (5, 6): c.fill = fill_red
-        c.border = thin
-
-    for r_idx, row in enumerate(bao_cao_data, start=3):
-        for c_idx, val in enumerate(row, start=1):
-            c = ws.cell(row=r_idx, column=c_idx, value=val)
-            c.border = thin
-            c.alignment = Alignment(horizontal="left" if c_idx == 2 else "center", vertical="center")
-
-    ws.column_dimensions["A"].width = 8
-    ws.column_dimensions["B"].width = 45
-    for col in ("C", "D", "E", "F"):
-        ws.column_dimensions[col].width = 22
+    hdr = {"bold": True, "align": "center", "valign": "vcenter", "text_wrap": True, "border": 1}
+    fmt_plain = book.add_format(hdr)
+    fmt_yellow = book.add_format({**hdr, "bg_color": "#FFFF00"})
+    fmt_red = book.add_format({**hdr, "bg_color": "#FF0000"})
+    for i, h in enumerate(headers):
+        fmt = fmt_yellow if i in (2, 3) else (fmt_red if i in (4, 5) else fmt_plain)
+        ws.write(1, i, h, fmt)
+
+    cell_center = book.add_format({"border": 1, "align": "center", "valign": "vcenter"})
+    cell_left = book.add_format({"border": 1, "align": "left", "valign": "vcenter"})
+    for r_idx, row in enumerate(bao_cao_data, start=2):
+        for c_idx, val in enumerate(row):
+            ws.write(r_idx, c_idx, val, cell_left if c_idx == 1 else cell_center)
 
 def tao_bao_cao_huy(writer: pd.ExcelWriter, bao_cao_huy: List[List]) -> None:
-    ws = writer.book.create_sheet("BaoCao_Huy")
-    ws.merge_cells("A1:C1")
-    ws["A1"] = "BÁO CÁO HỦY QUẦY TRƯNG BÀY KHÔNG ĐẠT  DOANH SỐ TỐI THIỂU 2 THÁNG LIÊN TIẾP"
-    ws["A1"].alignment = Alignment(horizontal="center", vertical="center")
-    ws["A1"].font = Font(bold=True, size=14)
+    book = writer.book
+    ws = book.add_worksheet("BaoCao_Huy")
+    ws.set_column(0, 0, 8)
+    ws.set_column(1, 1, 60)
+    ws.set_column(2, 2, 28)
+
+    title_fmt = book.add_format({"bold": True, "font_size": 14, "align": "center", "valign": "vcenter"})
+    ws.merge_range(0, 0, 0, 2, "BÁO CÁO HỦY QUẦY TRƯNG BÀY KHÔNG ĐẠT  DOANH SỐ TỐI THIỂU 2 THÁNG LIÊN TIẾP", title_fmt)
 
     headers = ["STT", "Tên chương trình", "TỔNG SỐ SUẤT HỦY TRƯNG BÀY TRÊN HT DMS"]
-    ws.append(headers)
-
-    fill_yellow = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-    thin = Border(left=Side("thin"), right=Side("thin"), top=Side("thin"), bottom=Side("thin"))
-    for i in range(1, 4):
-        c = ws.cell(row=2, column=i)
-        c.font = Font(bold=True)
-        c.fill = fill_yellow
-        c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        c.border = thin
-
-    for r_idx, row in enumerate(bao_cao_huy, start=3):
-        for c_idx, val in enumerate(row, start=1):
-            c = ws.cell(row=r_idx, column=c_idx, value=val)
-            c.border = thin
-            c.alignment = Alignment(horizontal="left" if c_idx == 2 else "center", vertical="center")
-
-    ws.column_dimensions["A"].width = 8
-    ws.column_dimensions["B"].width = 60
-    ws.column_dimensions["C"].width = 28
+    fmt_header = book.add_format({"bold": True, "bg_color": "#FFFF00", "align": "center",
+                                  "valign": "vcenter", "text_wrap": True, "border": 1})
+    for i, h in enumerate(headers):
+        ws.write(1, i, h, fmt_header)
+
+    cell_center = book.add_format({"border": 1, "align": "center", "valign": "vcenter"})
+    cell_left = book.add_format({"border": 1, "align": "left", "valign": "vcenter"})
+    for r_idx, row in enumerate(bao_cao_huy, start=2):
+        for c_idx, val in enumerate(row):
+            ws.write(r_idx, c_idx, val, cell_left if c_idx == 1 else cell_center)
 
 # =========================
 # CORE LOGIC (dataframe)
 # =========================
+def _read_xlsx_stream(file_bytes: bytes) -> pd.DataFrame:
+    """Đọc xlsx bằng openpyxl read_only (stream từng dòng, không dựng toàn bộ
+    object model — tiết kiệm RAM và nhanh hơn nhiều trên file lớn)."""
+    import openpyxl
+    wb = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        next(rows, None)  # bỏ dòng đầu (tương đương header=1)
+        header = next(rows, None)
+        data = list(rows)
+    finally:
+        wb.close()
+    if header is None:
+        return pd.DataFrame()
+    df = pd.DataFrame(data, columns=[str(h) if h is not None else "" for h in header])
+    for c in ("Mã khách hàng", "Mã NPP"):
+        if c in df.columns:
+            df[c] = df[c].map(lambda v: v if v is None else str(v))
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _parse_excel(file_bytes: bytes) -> pd.DataFrame:
+    """Parse 1 lần cho mỗi nội dung file (cache theo bytes)."""
+    if EXCEL_ENGINE == "calamine":
+        return pd.read_excel(io.BytesIO(file_bytes), header=1, engine="calamine",
+                             dtype={"Mã khách hàng": str, "Mã NPP": str})
+    return _read_xlsx_stream(file_bytes)
+
 def xu_ly_file(file_like, muc_toi_thieu: Dict[str, float], xbm_map: Dict[str, str]) -> Tuple[pd.DataFrame, str]:
-    df = pd.read_excel(file_like, header=1, dtype={"Mã khách hàng": str, "Mã NPP": str})
+    """Nhận bytes/file-like (parse qua cache) hoặc DataFrame đã parse sẵn."""
+    if isinstance(file_like, pd.DataFrame):
+        df = file_like
+    elif isinstance(file_like, (bytes, bytearray)):
+        df = _parse_excel(bytes(file_like))
+    else:
+        df = _parse_excel(file_like.read())
+    return _normalize(df, muc_toi_thieu, xbm_map)
+
+def _normalize(df: pd.DataFrame, muc_toi_thieu: Dict[str, float], xbm_map: Dict[str, str]) -> Tuple[pd.DataFrame, str]:
     cols_in = ["Mức đăng ký", "Miền", "Vùng", "Mã NPP", "Tên NPP",
                "Giai đoạn", "Mã NVBH", "Tên NVBH",
                "Mã khách hàng", "Tên khách hàng", "Thứ bán hàng", "Tuyến",
@@ -275,6 +307,18 @@ def xu_ly_file(file_like, muc_toi_thieu: Dict[str, float], xbm_map: Dict[str, st
     base = muc_map.map(muc_toi_thieu).fillna(0).astype(float)
     df["NguongToiThieu"] = base * pd.to_numeric(df["SoSuat"], errors="coerce").fillna(0).astype(float)
 
+    # Downcast số liệu (lossless) để giảm 1/2 băng thông bộ nhớ cho merge/sort phía sau
+    for c in ("SoSuat", "DoanhSo"):
+        s = pd.to_numeric(df[c], errors="coerce")
+        df[c] = pd.to_numeric(s, downcast="integer" if pd.api.types.is_integer_dtype(s) else "float")
+    df["NguongToiThieu"] = pd.to_numeric(df["NguongToiThieu"], downcast="float")
+
+    # Chuỗi lặp lại nhiều (mã/tên NPP, NVBH, miền...) -> category: các bước
+    # merge/sort/isin phía sau thao tác trên mã int thay vì chuỗi Python
+    for c in ("MaKH", "MucDK", "Mien", "Vung", "MaNPP", "TenNPP", "MaNVBH", "TenNVBH"):
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+
     giai = str(df["GiaiDoan"].iloc[0]).strip()
     df[f"SoSuat_{giai}"] = df["SoSuat"]
     df[f"DoanhSo_{giai}"] = df["DoanhSo"]
@@ -288,60 +332,124 @@ def xu_ly_chuong_trinh(
     xbm_map: Dict[str, str],
     file_t0: Optional[io.BytesIO] = None,
     filter_ketqua: Optional[set] = None,
-    filter_tuyen_tokens: Optional[List[str]] = None,
+    filter_tuyen_pat: Optional[re.Pattern] = None,
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
     df_t1, g1 = xu_ly_file(file_truoc, muc_toi_thieu, xbm_map)
     df_t2, g2 = xu_ly_file(file_sau, muc_toi_thieu, xbm_map)
 
-    new_in_T1_keys = set()
-    g0 = None
-    if file_t0:
+    df_t0, g0 = (None, None)
+    if file_t0 is not None:
         df_t0, g0 = xu_ly_file(file_t0, muc_toi_thieu, xbm_map)
-        keys_t0 = set(zip(df_t0["MaKH"], df_t0["MucDK"]))
-        keys_t1 = set(zip(df_t1["MaKH"], df_t1["MucDK"]))
-        new_in_T1_keys = keys_t1 - keys_t0
 
-    df = pd.merge(df_t1, df_t2, on=["MaKH", "MucDK"], how="outer", suffixes=("_T1", "_T2"))
-    if file_t0:
-        df = df.merge(df_t0[["MaKH", f"SoSuat_{g0}", f"DoanhSo_{g0}"]], on="MaKH", how="left")
+    # Factorize khóa join sang mã int32 chung cho cả 3 frame: merge hash số
+    # nguyên thay vì hash chuỗi Python từng dòng
+    frames = [df_t1, df_t2] + ([df_t0] if df_t0 is not None else [])
+    key_uniques = {}
+    for col in ("MaKH", "MucDK"):
+        codes, key_uniques[col] = pd.factorize(
+            pd.concat([f[col] for f in frames], ignore_index=True), use_na_sentinel=False)
+        i = 0
+        for f in frames:
+            f[f"{col}_c"] = codes[i:i + len(f)].astype(np.int32)
+            i += len(f)
+
+    # Khách mới trong T1 (không có ở T0): đóng gói (MaKH_c, MucDK_c) vào uint64
+    # và dùng np.isin thay cho set tuple Python
+    if df_t0 is not None:
+        packed_t0 = (df_t0["MaKH_c"].to_numpy(np.uint64) << 32) | df_t0["MucDK_c"].to_numpy(np.uint64)
+        packed_t1 = (df_t1["MaKH_c"].to_numpy(np.uint64) << 32) | df_t1["MucDK_c"].to_numpy(np.uint64)
+        df_t1["IsNewT1"] = np.isin(packed_t1, packed_t0, invert=True)
+    else:
+        df_t1["IsNewT1"] = False
+
+    # sort=False: giữ thứ tự xuất hiện, khỏi sắp xếp lại khóa (kết quả được sort
+    # tường minh ở cuối). Không validate one_to_one ở đây: 1 khách đứng nhiều NPP
+    # là dữ liệu hợp lệ và được khử trùng lặp phía dưới.
+    df = pd.merge(df_t1.drop(columns=["MaKH", "MucDK"]),
+                  df_t2.drop(columns=["MaKH", "MucDK"]),
+                  on=["MaKH_c", "MucDK_c"], how="outer", suffixes=("_T1", "_T2"), sort=False)
+    # Khôi phục khóa chuỗi từ mã factorize
+    df["MaKH"] = key_uniques["MaKH"].take(df["MaKH_c"].to_numpy())
+    df["MucDK"] = key_uniques["MucDK"].take(df["MucDK_c"].to_numpy())
+    if file_t0 is not None:
+        # 1 khách đứng nhiều NPP trong T0 là dữ liệu hợp lệ (như T1/T2); khử
+        # trùng theo đúng quy tắc giữ NPP mới nhất trước khi join để left join
+        # không nhân bản dòng. validate giữ lại như một bất biến sau khi khử.
+        t0_cols = df_t0.sort_values(by=["MaKH_c", "MaNPP"], na_position="first") \
+                       .drop_duplicates(subset=["MaKH_c"], keep="last")
+        df = df.merge(t0_cols[["MaKH_c", f"SoSuat_{g0}", f"DoanhSo_{g0}"]],
+                      on="MaKH_c", how="left", sort=False, validate="many_to_one")
+    df = df.drop(columns=["MaKH_c", "MucDK_c"])
 
     for col in [f"SoSuat_{g1}", f"SoSuat_{g2}", f"DoanhSo_{g1}", f"DoanhSo_{g2}", f"Nguong_{g1}", f"Nguong_{g2}"]:
         if col in df.columns:
             df[col] = df[col].fillna(0)
 
-    def xet(row):
-        ds1, ds2 = row.get(f"DoanhSo_{g1}", 0) or 0, row.get(f"DoanhSo_{g2}", 0) or 0
-        ss1, ss2 = row.get(f"SoSuat_{g1}", 0) or 0, row.get(f"SoSuat_{g2}", 0) or 0
-        n1, n2 = row.get(f"Nguong_{g1}", 0) or 0, row.get(f"Nguong_{g2}", 0) or 0
-        key = (row.get("MaKH"), row.get("MucDK"))
-
-        if ss1 > 0 and ss2 == 0: return "XOA", "Tháng trước có tham gia, tháng sau không tham gia"
-        if ss1 > 0 and key in new_in_T1_keys: return "Đạt", "Khách mới tháng trước (DS xét chu kỳ 11/T0→10/T1)"
-        if ss1 == 0 and ss2 > 0: return "Không xét", "Khách hàng mới tháng sau (không xét kết quả kỳ này)"
-        if ss2 > ss1 > 0: return "Đạt", f"Nâng suất từ {int(ss1)} → {int(ss2)} (auto đạt)"
-        if ss2 < ss1:
-            if (ds1 >= n1) or (ds2 >= n2):
-                return "Đạt", f"Giảm suất từ {int(ss1)} → {int(ss2)} (1 trong 2 tháng đủ ngưỡng)"
-            else:
-                return "Không đạt", f"Giảm suất từ {int(ss1)} → {int(ss2)} (2 tháng đều không đủ ngưỡng)"
-        if (ds1 >= n1) or (ds2 >= n2): return "Đạt", ""
-        return "Không đạt", "Doanh số 2 tháng liên tiếp không đủ theo yêu cầu"
-
-    df[["KetQua", "GhiChu"]] = df.apply(lambda r: pd.Series(xet(r)), axis=1)
-
-    df_removed = df[df["KetQua"] == "XOA"].copy()
-    df_final = df[df["KetQua"] != "XOA"].copy()
-
-    counts = df_final["MaKH"].value_counts()
-    multi = counts[counts > 1].index
-    df_multi = df_final[df_final["MaKH"].isin(multi)].copy()
-
-    df_final = df_final.sort_values(by=["MaKH", "MaNPP_T2"], na_position="first").drop_duplicates(subset=["MaKH"], keep="last")
-    df_removed_multi = df_multi.merge(df_final[["MaKH"]], on="MaKH", how="left", indicator=True)
-    df_removed_multi = df_removed_multi[df_removed_multi["_merge"] == "left_only"].drop(columns="_merge")
-    df_removed_multi["GhiChu"] = df_removed_multi["MaKH"].map(lambda x: f"Khách hàng xuất hiện {counts[x]} lần, đã giữ bản ghi NPP mới nhất")
-    df_removed = pd.concat([df_removed, df_removed_multi], ignore_index=True)
+    # Phân loại vector hóa (np.select) thay cho df.apply từng dòng
+    ds1 = df[f"DoanhSo_{g1}"].to_numpy(float)
+    ds2 = df[f"DoanhSo_{g2}"].to_numpy(float)
+    ss1 = df[f"SoSuat_{g1}"].to_numpy(float)
+    ss2 = df[f"SoSuat_{g2}"].to_numpy(float)
+    n1 = df[f"Nguong_{g1}"].to_numpy(float)
+    n2 = df[f"Nguong_{g2}"].to_numpy(float)
+
+    is_new = df["IsNewT1"].fillna(False).to_numpy(dtype=bool)
+
+    m_xoa = (ss1 > 0) & (ss2 == 0)
+    m_new_t1 = (ss1 > 0) & is_new
+    m_new_t2 = (ss1 == 0) & (ss2 > 0)
+    m_up = (ss2 > ss1) & (ss1 > 0)
+    m_down = ss2 < ss1
+    m_du_nguong = (ds1 >= n1) | (ds2 >= n2)
+
+    # Kernel ra mã int8 một lần; nhãn tra bảng, ghi chú chỉ dựng trên tập dòng
+    # của từng mã (không format chuỗi cho toàn bộ frame)
+    C_XOA, C_MOI_T1, C_MOI_T2, C_NANG, C_GIAM_DAT, C_GIAM_HONG, C_DAT, C_HONG = range(8)
+    codes = np.select(
+        [m_xoa, m_new_t1, m_new_t2, m_up,
+         m_down & m_du_nguong, m_down & ~m_du_nguong, m_du_nguong],
+        [C_XOA, C_MOI_T1, C_MOI_T2, C_NANG, C_GIAM_DAT, C_GIAM_HONG, C_DAT],
+        default=C_HONG).astype(np.int8)
+
+    nhan = np.array(["XOA", "Đạt", "Không xét", "Đạt", "Đạt", "Không đạt", "Đạt", "Không đạt"],
+                    dtype=object)
+    df["KetQua"] = nhan[codes]
+
+    ghichu = np.full(len(df), "", dtype=object)
+    ghichu[codes == C_XOA] = "Tháng trước có tham gia, tháng sau không tham gia"
+    ghichu[codes == C_MOI_T1] = "Khách mới tháng trước (DS xét chu kỳ 11/T0→10/T1)"
+    ghichu[codes == C_MOI_T2] = "Khách hàng mới tháng sau (không xét kết quả kỳ này)"
+    ghichu[codes == C_HONG] = "Doanh số 2 tháng liên tiếp không đủ theo yêu cầu"
+    for code, dau, duoi in ((C_NANG, "Nâng suất từ ", " (auto đạt)"),
+                            (C_GIAM_DAT, "Giảm suất từ ", " (1 trong 2 tháng đủ ngưỡng)"),
+                            (C_GIAM_HONG, "Giảm suất từ ", " (2 tháng đều không đủ ngưỡng)")):
+        m = codes == code
+        if m.any():
+            ghichu[m] = (dau + ss1[m].astype(np.int64).astype(str).astype(object)
+                         + " → " + ss2[m].astype(np.int64).astype(str).astype(object) + duoi)
+    df["GhiChu"] = ghichu
+
+    # Tách theo mask numpy, không .copy() cả frame 2 lần (copy-on-write lo phần còn lại)
+    mask_xoa = df["KetQua"].eq("XOA").to_numpy()
+    df_removed = df[mask_xoa]
+    df_final = df[~mask_xoa]
+
+    # Khử trùng lặp 1 lượt quét: sort rồi duplicated(keep="last") thay cho
+    # value_counts + isin + merge indicator (3 lượt). Các dòng bị loại đi
+    # thẳng vào báo cáo hủy kèm ghi chú số lần xuất hiện.
+    df_final = df_final.sort_values(by=["MaKH", "MaNPP_T2"], na_position="first")
+    dup_mask = df_final["MaKH"].duplicated(keep="last").to_numpy()
+    if dup_mask.any():
+        # Đếm số lần xuất hiện bằng mã factorize + bincount (chỉ số nguyên,
+        # khỏi dựng Series value_counts rồi tra hash theo chuỗi)
+        codes, _ = pd.factorize(df_final["MaKH"])
+        per_code = np.bincount(codes)
+        df_removed_multi = df_final[dup_mask].copy()
+        n_lan = pd.Series(per_code[codes[dup_mask]].astype(str), index=df_removed_multi.index)
+        df_removed_multi["GhiChu"] = "Khách hàng xuất hiện " + n_lan + " lần, đã giữ bản ghi NPP mới nhất"
+        df_removed = pd.concat([df_removed, df_removed_multi], ignore_index=True)
+    df_final = df_final[~dup_mask]
 
     # Lọc theo Kết quả
     if filter_ketqua is not None and "KetQua" in df_final.columns:
@@ -349,9 +457,8 @@ def xu_ly_chuong_trinh(
 
     # Lọc theo 'Thứ bán hàng' (fallback 'Tuyến'), không xuất cột 'Tuyến'
     route_col = "ThuBanHang_T2" if "ThuBanHang_T2" in df_final.columns else ("Tuyen_T2" if "Tuyen_T2" in df_final.columns else None)
-    if filter_tuyen_tokens and route_col:
-        toks = [t.strip().lower() for t in filter_tuyen_tokens if t]
-        mask = df_final[route_col].astype(str).str.lower().apply(lambda s: any(tok in s for tok in toks))
+    if filter_tuyen_pat is not None and route_col:
+        mask = df_final[route_col].astype(str).str.contains(filter_tuyen_pat, na=False)
         df_final = df_final[mask]
 
     # Cột xuất ra (BỎ 'Tuyen_T2')
@@ -359,7 +466,7 @@ def xu_ly_chuong_trinh(
         "MucDK", "Mien_T2", "Vung_T2", "MaNPP_T2", "TenNPP_T2",
         "MaNVBH_T2", "TenNVBH_T2", "MaKH", "TenKH_T2", "ThuBanHang_T2",
     ]
-    if file_t0:
+    if file_t0 is not None:
         cols_output += [f"SoSuat_{g0}", f"DoanhSo_{g0}"]
     cols_output += [
         f"SoSuat_{g1}", f"SoSuat_{g2}",
@@ -381,27 +488,49 @@ def xu_ly_chuong_trinh(
         f"Nguong_{g2}": "Ngưỡng tối thiểu",
         "KetQua": "Kết quả", "GhiChu": "Ghi chú",
     }
-    if file_t0:
+    if file_t0 is not None:
         rename_cols[f"SoSuat_{g0}"] = f"Số suất đăng ký {g0}"
         rename_cols[f"DoanhSo_{g0}"] = f"Doanh số tích lũy {g0}"
 
-    df_out = df_final[cols_output].copy().rename(columns=rename_cols)
-    df_removed_out = df_removed[cols_output].copy().rename(columns=rename_cols)
+    df_out = df_final[cols_output].rename(columns=rename_cols)
+    df_removed_out = df_removed[cols_output].rename(columns=rename_cols)
 
     # --- GSBH notes: chỉ để lại "Thiếu: xxx" cho Không đạt ---
-    def fmt_v(v): return f"{int(round(float(v))):,}".replace(",", ".")
     if "Ngưỡng tối thiểu" in df_out.columns:
         doanh_so_cols = sorted([c for c in df_out.columns if c.startswith("Doanh số tích lũy ")])
         if doanh_so_cols:
             col_ds_t2 = doanh_so_cols[-1]
             mask_nd = df_out["Kết quả"].eq("Không đạt")
-            remain = (df_out.loc[mask_nd, "Ngưỡng tối thiểu"].astype(float) - df_out.loc[mask_nd, col_ds_t2].astype(float)).clip(lower=0)
-            df_out.loc[mask_nd, "Ghi chú"] = remain.map(lambda v: f"Thiếu: {fmt_v(v)}")
+            if mask_nd.any():
+                remain = (df_out.loc[mask_nd, "Ngưỡng tối thiểu"].astype(float) - df_out.loc[mask_nd, col_ds_t2].astype(float)).clip(lower=0)
+                remain_s = remain.round().astype("int64").map("{:,}".format).str.replace(",", ".", regex=False)
+                df_out.loc[mask_nd, "Ghi chú"] = "Thiếu: " + remain_s
 
     df_out = df_out.sort_values(by=["Mã NPP", "Mã NVBH", "Tên khách hàng"])
     df_removed_out = df_removed_out.sort_values(by=["Mã NPP", "Mã NVBH", "Tên khách hàng"])
     return df_out, df_removed_out
 
+def _mask_mien(df: pd.DataFrame, mien_values: List[str]) -> np.ndarray:
+    """Mask lọc theo 'Miền' trên mã category (so sánh int) thay vì chuỗi từng dòng."""
+    mien = df["Miền"]
+    if isinstance(mien.dtype, pd.CategoricalDtype):
+        wanted = set(mien_values)
+        keep = [i for i, c in enumerate(mien.cat.categories) if c in wanted]
+        return np.isin(mien.cat.codes.to_numpy(), keep)
+    return mien.isin(mien_values).to_numpy()
+
+def _process_ct(
+    ct: str, df_t0: Optional[pd.DataFrame], df_t1: pd.DataFrame, df_t2: pd.DataFrame,
+    muc_toi_thieu: Dict[str, float], program_names: Dict[str, str], xbm_map: Dict[str, str],
+    filter_ketqua: Optional[set], filter_tuyen_pat: Optional[re.Pattern],
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Xử lý 1 CT (mọi miền) — độc lập với CT khác nên chạy được trong pool."""
+    return xu_ly_chuong_trinh(
+        file_truoc=df_t1, file_sau=df_t2,
+        muc_toi_thieu=muc_toi_thieu, program_names=program_names, xbm_map=xbm_map,
+        file_t0=df_t0, filter_ketqua=filter_ketqua, filter_tuyen_pat=filter_tuyen_pat,
+    )
+
 # =============== Streamlit UI ===============
 st.set_page_config(page_title="Cholimex Display Checker", layout="wide")
 st.title("Cholimex Foods Display Checker (Web)")
@@ -431,26 +560,26 @@ err_msgs = []
 if uploads:
     for f in uploads:
         data = f.read()
-        bio = io.BytesIO(data)
         try:
-            # Đọc nhanh để bắt CT & Giai đoạn
-            df_preview = pd.read_excel(io.BytesIO(data), header=1)
-            ct = detect_ct_from_content(df_preview)
+            # Parse đúng 1 lần/file; dùng lại cho nhận diện CT, quét tuyến & xử lý
+            df_raw = _parse_excel(data)
+            ct = detect_ct_from_content(df_raw)
             if not ct:
                 ct = detect_ct_from_filename(f.name)  # fallback
             if not ct:
                 err_msgs.append(f"- Không nhận diện được CT từ: {f.name} (thiếu 'Mức đăng ký' hoặc tên file không chứa mã CT).")
                 continue
 
-            if "Giai đoạn" not in df_preview.columns:
+            if "Giai đoạn" not in df_raw.columns:
                 err_msgs.append(f"- File {f.name} thiếu cột 'Giai đoạn'.")
                 continue
-            giai_val = str(df_preview["Giai đoạn"].dropna().iloc[0]).strip()
+            giai_val = str(df_raw["Giai đoạn"].dropna().iloc[0]).strip()
             dt = parse_giai_to_dt(giai_val)
 
             file_entries.append({
                 "name": f.name,
-                "bytes": data,      # lưu bytes để đọc lại nhiều lần
+                "bytes": data,
+                "df": df_raw,       # DataFrame đã parse, dùng lại ở mọi bước sau
                 "ct": ct,
                 "giai": giai_val,
                 "dt": dt
@@ -467,7 +596,7 @@ if file_entries:
     for ct, items in by_ct.items():
         last = sorted(items, key=lambda x: x["dt"])[-1]
         try:
-            df_last = pd.read_excel(io.BytesIO(last["bytes"]), header=1)
+            df_last = last["df"]
             col = None
             for cand in ["Thứ bán hàng", "ThuBanHang", "Tuyến", "Tuyen", "Route", "Tuyến bán hàng", "Tuyến BH", "Mã tuyến", "T/BH", "TBH"]:
                 if cand in df_last.columns:
@@ -498,10 +627,6 @@ if run:
     for ent in file_entries:
         by_ct[ent["ct"]].append(ent)
 
-    # Kết quả theo từng miền (tạo file Excel trong memory)
-    outputs_per_region = {}     # region -> BytesIO
-    outputs_xoa_per_region = {} # chỉ MKT
-
     # Chọn bộ lọc kết quả
     if kq_all:
         selected_kq = None
@@ -513,50 +638,96 @@ if run:
         if not selected_kq:
             selected_kq = None
 
-    for region in sel_regions:
+    # Mỗi CT chỉ tính 1 lần (miền chỉ là filter cuối) -> song song theo CT,
+    # sau đó mỗi miền chỉ việc cắt lát + ghi
+    tasks = []
+    for ct, items in by_ct.items():
+        items_sorted = sorted(items, key=lambda x: x["dt"])
+        # cần >=2 tháng
+        if len(items_sorted) < 2:
+            continue
+        # lấy T1, T2 (2 tháng cuối) và optional T0
+        t2 = items_sorted[-1]
+        t1 = items_sorted[-2]
+        t0 = items_sorted[0] if len(items_sorted) >= 3 else None
+        tasks.append((ct, (t0["df"] if t0 else None), t1["df"], t2["df"]))
+
+    try:
+        mp_ctx = multiprocessing.get_context("fork")
+    except ValueError:
+        mp_ctx = None  # không có fork (Windows) -> chạy tuần tự
+
+    route_pat = _compile_route_pat(sel_routes)  # compile 1 lần cho mọi CT
+    results = {}  # ct -> (df_out, df_removed) chưa lọc miền
+    if mp_ctx is not None and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=mp_ctx) as ex:
+            futs = {
+                ex.submit(_process_ct, ct, df0, df1, df2,
+                          MUC_TOI_THIEU, PROGRAM_NAMES, XBM_MAP,
+                          selected_kq, route_pat): ct
+                for ct, df0, df1, df2 in tasks
+            }
+            for fut in as_completed(futs):
+                ct = futs[fut]
+                try:
+                    results[ct] = fut.result()
+                except Exception as e:
+                    st.error(f"Lỗi xử lý CT {ct}: {e}")
+    else:
+        for ct, df0, df1, df2 in tasks:
+            try:
+                results[ct] = _process_ct(
+                    ct, df0, df1, df2,
+                    MUC_TOI_THIEU, PROGRAM_NAMES, XBM_MAP,
+                    selected_kq, route_pat)
+            except Exception as e:
+                st.error(f"Lỗi xử lý CT {ct}: {e}")
+
+    # Mask miền tính 1 lần/CT cho mọi miền đã chọn
+    region_masks = {}  # (ct, region) -> (mask_out, mask_removed)
+    for ct, (df_out_full, df_removed_full) in results.items():
+        for region in sel_regions:
+            if REGION_MAP.get(region) != "ALL":
+                region_masks[(ct, region)] = (_mask_mien(df_out_full, REGION_MAP[region]),
+                                              _mask_mien(df_removed_full, REGION_MAP[region]))
+
+    zip_buf = io.BytesIO()
+    zf = zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED, compresslevel=1)
+
+    def _zip_add(name: str, bio: io.BytesIO) -> None:
+        # Ghi thẳng buffer vào zip (zf.open) thay vì getvalue() + writestr:
+        # tránh giữ thêm 2 bản copy bytes của workbook cùng lúc
+        with zf.open(name, "w", force_zip64=True) as dst:
+            dst.write(bio.getbuffer())
+    so_file = 0
+
+    def _write_region(region: str) -> Tuple[io.BytesIO, Optional[io.BytesIO], List[str]]:
+        """Dựng workbook của 1 miền vào BytesIO (chạy được trong thread:
+        xlsxwriter thả GIL khi nén DEFLATE nên các miền chồng lấp tốt)."""
+        warns = []
         bao_cao_data, bao_cao_huy = [], []
 
-        # Writer chính
+        # Writer chính (xlsxwriter + constant_memory: stream từng dòng, không giữ cả workbook trong RAM)
         bio_main = io.BytesIO()
-        writer_main = pd.ExcelWriter(bio_main, engine="openpyxl")
+        writer_main = pd.ExcelWriter(bio_main, engine="xlsxwriter",
+                                     engine_kwargs={"options": {"constant_memory": True, "strings_to_urls": False}})
         # Writer XÓA (MKT)
         writer_xoa = None
         bio_xoa = None
         if mode != "GSBH":
             bio_xoa = io.BytesIO()
-            writer_xoa = pd.ExcelWriter(bio_xoa, engine="openpyxl")
+            writer_xoa = pd.ExcelWriter(bio_xoa, engine="xlsxwriter",
+                                        engine_kwargs={"options": {"constant_memory": True, "strings_to_urls": False}})
 
         idx = 0
-        for ct, items in by_ct.items():
-            items_sorted = sorted(items, key=lambda x: x["dt"])
-            # cần >=2 tháng
-            if len(items_sorted) < 2:
+        for ct in by_ct.keys():
+            if ct not in results:
                 continue
-            # lấy T1, T2 (2 tháng cuối) và optional T0
-            t2 = items_sorted[-1]
-            t1 = items_sorted[-2]
-            t0 = items_sorted[0] if len(items_sorted) >= 3 else None
-
-            # Process
-            try:
-                df_out, df_removed = xu_ly_chuong_trinh(
-                    file_truoc=io.BytesIO(t1["bytes"]),
-                    file_sau=io.BytesIO(t2["bytes"]),
-                    muc_toi_thieu=MUC_TOI_THIEU,
-                    program_names=PROGRAM_NAMES,
-                    xbm_map=XBM_MAP,
-                    file_t0=(io.BytesIO(t0["bytes"]) if t0 else None),
-                    filter_ketqua=selected_kq,
-                    filter_tuyen_tokens=(sel_routes if sel_routes else None),
-                )
-            except Exception as e:
-                st.error(f"Lỗi xử lý CT {ct}: {e}")
-                continue
-
-            # Lọc theo miền
-            if REGION_MAP.get(region) != "ALL":
-                df_out = df_out[df_out["Miền"].isin(REGION_MAP[region])]
-                df_removed = df_removed[df_removed["Miền"].isin(REGION_MAP[region])]
+            df_out, df_removed = results[ct]
+            if (ct, region) in region_masks:
+                mask_out, mask_removed = region_masks[(ct, region)]
+                df_out = df_out[mask_out]
+                df_removed = df_removed[mask_removed]
 
             # GSBH: rút gọn cột + giữ định dạng
             if mode == "GSBH":
@@ -573,59 +744,73 @@ if run:
                 df_out = df_out[keep_cols]
 
             # Ghi sheet
-            df_out.to_excel(writer_main, sheet_name=ct, index=False)
-            style_excel(writer_main, ct)
+            ghi_sheet_ketqua(writer_main, df_out, ct)
             if mode != "GSBH" and writer_xoa is not None:
-                df_removed.to_excel(writer_xoa, sheet_name=ct, index=False)
-                style_excel(writer_xoa, ct)
+                ghi_sheet_ketqua(writer_xoa, df_removed, ct)
 
             # Tổng hợp
             try:
                 idx += 1
-                tong_suat = df_out.filter(like="Số suất đăng ký").iloc[:, -1].sum()
-                ko_dat = df_out.loc[df_out["Kết quả"] == "Không đạt", :].filter(like="Số suất đăng ký").iloc[:, -1].sum()
+                last_ss = [c for c in df_out.columns if c.startswith("Số suất đăng ký ")][-1]
+                tong_suat = df_out[last_ss].sum()
+                ko_dat = df_out.loc[df_out["Kết quả"].eq("Không đạt"), last_ss].sum()
                 tile = f"{(ko_dat / tong_suat):.1%}" if tong_suat > 0 else "0%"
                 bao_cao_data.append([idx, PROGRAM_NAMES.get(ct, ct), MUC_TOI_THIEU.get(ct, 0), int(tong_suat), int(ko_dat), tile])
                 if mode != "GSBH":
-                    so_huy = df_out.loc[df_out["Kết quả"] == "Không đạt", :].filter(like="Số suất đăng ký").iloc[:, -1].sum()
-                    bao_cao_huy.append([idx, PROGRAM_NAMES.get(ct, ct), int(so_huy)])
+                    # số suất hủy = số suất "Không đạt" của tháng mới nhất
+                    bao_cao_huy.append([idx, PROGRAM_NAMES.get(ct, ct), int(ko_dat)])
             except Exception as e:
-                st.warning(f"⚠️ Lỗi thống kê CT {ct}: {e}")
+                warns.append(f"⚠️ Lỗi thống kê CT {ct}: {e}")
 
         # Sheet tổng hợp
         if bao_cao_data:
             try: tao_bao_cao_tonghop(writer_main, bao_cao_data)
-            except Exception as e: st.warning(f"⚠️ Lỗi tạo BaoCao_TongHop: {e}")
+            except Exception as e: warns.append(f"⚠️ Lỗi tạo BaoCao_TongHop: {e}")
         if (mode != "GSBH") and bao_cao_huy:
             try: tao_bao_cao_huy(writer_main, bao_cao_huy)
-            except Exception as e: st.warning(f"⚠️ Lỗi tạo BaoCao_Huy: {e}")
+            except Exception as e: warns.append(f"⚠️ Lỗi tạo BaoCao_Huy: {e}")
 
         writer_main.close()
-        outputs_per_region[region] = bio_main.getvalue()
-        if mode != "GSBH" and writer_xoa is not None:
+        if writer_xoa is not None:
             writer_xoa.close()
-            outputs_xoa_per_region[region] = bio_xoa.getvalue()
+        return bio_main, bio_xoa, warns
+
+    # Ghi các miền song song bằng thread (workbook độc lập, GIL được thả khi
+    # nén); ZIP vẫn ghi tuần tự theo thứ tự miền đã chọn
+    region_bufs = {}  # region -> (bio_main, bio_xoa, warns)
+    if len(sel_regions) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(sel_regions), 4)) as tx:
+            futs = {tx.submit(_write_region, r): r for r in sel_regions}
+            for fut in as_completed(futs):
+                r = futs[fut]
+                try:
+                    region_bufs[r] = fut.result()
+                except Exception as e:
+                    st.error(f"Lỗi ghi miền {r}: {e}")
+    else:
+        for r in sel_regions:
+            try:
+                region_bufs[r] = _write_region(r)
+            except Exception as e:
+                st.error(f"Lỗi ghi miền {r}: {e}")
 
+    for region in sel_regions:
+        if region not in region_bufs:
+            continue
+        bio_main, bio_xoa, warns = region_bufs[region]
+        for w in warns:
+            st.warning(w)
+        _zip_add(f"TongHop_{region}{'_GSBH' if mode=='GSBH' else ''}.xlsx", bio_main)
+        bio_main.close()
+        so_file += 1
+        if mode != "GSBH" and bio_xoa is not None:
+            _zip_add(f"TongHop_Xoa_{region}.xlsx", bio_xoa)
+            bio_xoa.close()
+            so_file += 1
+
+    zf.close()
     st.success("✅ Đã xử lý xong.")
-    # Tải từng file hoặc ZIP
-    cols = st.columns(2)
-    with cols[0]:
-        st.markdown("**Tải từng miền**")
-        for region, data in outputs_per_region.items():
-            label = f"⬇️ Tải {region} ({'GSBH' if mode=='GSBH' else 'MKT'})"
-            st.download_button(label, data=data, file_name=f"TongHop_{region}{'_GSBH' if mode=='GSBH' else ''}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        if mode != "GSBH":
-            st.markdown("**Tải file XÓA (MKT)**")
-            for region, data in outputs_xoa_per_region.items():
-                st.download_button(f"⬇️ Tải Xóa {region}", data=data, file_name=f"TongHop_Xoa_{region}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    with cols[1]:
-        if outputs_per_region:
-            st.markdown("**Tải tất cả dưới dạng ZIP**")
-            zip_buf = io.BytesIO()
-            with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as zf:
-                for region, data in outputs_per_region.items():
-                    zf.writestr(f"TongHop_{region}{'_GSBH' if mode=='GSBH' else ''}.xlsx", data)
-                if mode != "GSBH":
-                    for region, data in outputs_xoa_per_region.items():
-                        zf.writestr(f"TongHop_Xoa_{region}.xlsx", data)
-            st.download_button("⬇️ Tải tất cả (.zip)", data=zip_buf.getvalue(), file_name="KetQua_TongHop.zip", mime="application/zip")
+    if so_file:
+        st.markdown(f"**Tải tất cả ({so_file} file)**")
+        st.download_button("⬇️ Tải tất cả (.zip)", data=zip_buf.getvalue(),
+                           file_name="KetQua_TongHop.zip", mime="application/zip")